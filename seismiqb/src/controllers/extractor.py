@@ -10,6 +10,7 @@ from ...batchflow import Pipeline, B, V, C, D, P, R
 from ...batchflow.models.torch import EncoderDecoder
 
 from ..cubeset import Horizon, HorizonMetrics
+from ..utils import histogramdd
 
 from .base import BaseController
 
@@ -37,7 +38,7 @@ class Extractor(BaseController):
         points = np.hstack([idx[0].reshape(-1, 1),
                             idx[1].reshape(-1, 1)])
 
-        geometry_sampler = HistoSampler(np.histogramdd(points/geometry.cube_shape[:2], bins=bins))
+        geometry_sampler = HistoSampler(histogramdd(points/geometry.cube_shape[:2], bins=bins))
         geometry_sampler = geometry_sampler & NumpySampler('u', low=0., high=0.9)
 
         dataset.create_sampler(mode=geometry_sampler)
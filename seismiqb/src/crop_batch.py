@@ -164,9 +164,11 @@ class SeismicCropBatch(Batch):
         # pylint: disable=protected-access
 
         if not hasattr(self, 'transformed'):
-            new_index = [self.salt(ix) for ix in points[:, 0]]
-            new_dict = {ix: self.index.get_fullpath(self.unsalt(ix))
-                        for ix in new_index}
+            # Grids emit points of a single cube, so paths are resolved once per distinct name
+            names = points[:, 0]
+            paths = {name: self.index.get_fullpath(self.unsalt(name)) for name in set(names)}
+            new_index = [self.salt(ix) for ix in names]
+            new_dict = {ix: paths[name] for ix, name in zip(new_index, names)}
             new_batch = type(self)(FilesIndex.from_index(index=new_index, paths=new_dict, dirs=False))
             new_batch.transformed = True
 
@@ -192,8 +194,7 @@ class SeismicCropBatch(Batch):
             locations = [self._make_location(point, shape, direction) for point, shape in corrected_points_shapes]
         else:
             shapes = self._make_shapes(points, shape, side_view)
-
-            locations = [self._make_location(point, shape, direction) for point, shape in zip(points, shapes)]
+            locations = self._make_locations(points, shapes, direction)
 
         new_batch.add_components((dst_points, dst_shapes), (points, shapes))
         new_batch.add_components(dst, locations)
@@ -237,6 +238,29 @@ class SeismicCropBatch(Batch):
             location.append(slice(start, stop))
         return location
 
+    def _make_locations(self, points, shapes, direction=(0, 0, 0)):
+        """ Creates list of slices for every point at once: same as :meth:`._make_location`,
+        but coordinates are converted to numbers and scaled to cube shapes in a few vectorized operations.
+        """
+        shapes = np.asarray(shapes).reshape(-1, 3)
+        coords = points[:, 1:4]
+        relative = np.array([isinstance(i, float) or isinstance(x, float) or isinstance(h, float)
+                             for i, x, h in coords], dtype=bool).reshape(-1)
+
+        anchor_points = np.empty((len(points), 3), dtype=np.int64)
+        anchor_points[~relative] = coords[~relative].astype(np.int64)
+        if relative.any():
+            names = points[:, 0]
+            for ix in set(names[relative]):
+                mask = relative & (names == ix)
+                cube_shape = np.array(self.get(ix, 'geometries').cube_shape)
+                anchor_points[mask] = np.rint(coords[mask].astype(float) * (cube_shape - shapes[mask])).astype(int)
+
+        starts = np.maximum(anchor_points - np.asarray(direction) * shapes, 0).astype(np.int64)
+        stops = starts + shapes
+        return [[slice(start, stop) for start, stop in zip(starts_, stops_)]
+                for starts_, stops_ in zip(starts.tolist(), stops.tolist())]
+
     def _correct_point_to_grid(self, point, shape, grid_src='quality_grid', eps=3):
         """ Move the point to the closest location in the quality grid. """
         #pylint: disable=too-many-return-statements
@@ -1,6 +1,9 @@
 """ Contains container for storing dataset of seismic crops. """
 #pylint: disable=too-many-lines
 from glob import glob
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
 
 import numpy as np
 
@@ -13,13 +16,89 @@ from .crop_batch import SeismicCropBatch
 from .horizon import Horizon, UnstructuredHorizon
 from .metrics import HorizonMetrics
 from .plotters import plot_image
-from .utils import IndexedDict, round_to_array, gen_crop_coordinates
+from .utils import IndexedDict, LazyIndexedDict, BatchGenerator, round_to_ticks, gen_extension_crops
+from .utils import make_summed_area_table, window_sum
 
 
 
-def astype_object(array):
-    """ Converts array to `object` dtype. Picklable, unlike inline lambda function. """
-    return array.astype(np.object)
+def decode_points(array, names):
+    """ Replace cube codes in the first column of numeric array with cube names from `names`.
+    Converts array to `object` dtype. Picklable, unlike inline lambda function.
+    """
+    points = np.empty(array.shape, dtype=object)
+    points[:, 0] = names[array[:, 0].astype(np.int32)]
+    points[:, 1:] = array[:, 1:]
+    return points
+
+
+def points_axis(array, axis):
+    """ Coordinates of points along `axis`. Picklable, unlike inline lambda function. """
+    return array[:, axis+1]
+
+
+def round_points_to_ticks(array, axis, cube_names, cube_shapes, each_start, each):
+    """ Move coordinates of points along `axis` to the closest of every `each`-th line of their cubes.
+    `cube_names` must be sorted, `cube_shapes` contains shapes of respective cubes.
+    """
+    if len(array) == 0:
+        return array
+
+    # Group points by cube: names are compared only once, grouping itself works on integer codes
+    names, inverse = np.unique(array[:, 0], return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.r_[0, np.cumsum(np.bincount(inverse, minlength=len(names)))]
+
+    axis_shapes = cube_shapes[np.searchsorted(cube_names, names), axis].astype(np.int64)
+
+    for shape, start, stop in zip(axis_shapes, bounds[:-1], bounds[1:]):
+        idx = order[start:stop]
+        values = array[idx, axis+1].astype(np.float64)
+        array[idx, axis+1] = round_to_ticks(values, shape, each_start, each)
+    return array
+
+
+def scale_points(array, shapes):
+    """ Change coordinates of points from unit cube to cube coordinates.
+    `shapes` is either one cube shape for all of the points or an array with shape for each point.
+    """
+    # Scale and round inplace in one float buffer
+    coords = array[:, 1:].astype(np.float64)
+    np.multiply(coords, shapes, out=coords)
+    np.rint(coords, out=coords)
+    array[:, 1:] = coords.astype(int)
+    return array
+
+
+def points_to_cube(array, cube_names, cube_shapes):
+    """ Change coordinates of points from unit cube to coordinates of their cubes.
+    `cube_names` must be sorted, `cube_shapes` contains shapes of respective cubes.
+    """
+    # Locate unique cubes in the table, then gather shapes for every point
+    names, inverse = np.unique(array[:, 0], return_inverse=True)
+    shapes = cube_shapes[np.searchsorted(cube_names, names)[inverse.reshape(-1)]]
+    return scale_points(array, shapes)
+
+
+def mixture(samplers):
+    """ Combine samplers into a mixture with a balanced tree of `|` operations.
+    Depth of the tree, and therefore of every `sample` call, is logarithmic in the number of samplers.
+    """
+    samplers = list(samplers)
+    while len(samplers) > 1:
+        pairs = [samplers[i] | samplers[i + 1] for i in range(0, len(samplers) - 1, 2)]
+        samplers = pairs + samplers[len(pairs) * 2:]
+    return samplers[0]
+
+
+def make_points(cube_name, coords):
+    """ Prepend reference to the cube to every row of integer coordinates.
+    Result is a valid `points` input for `crop` action of SeismicCropBatch.
+    """
+    points = np.empty((len(coords), 4), dtype=object)
+    points[:, 0] = cube_name
+    points[:, 1:] = coords
+    return points
 
 
 
@@ -30,7 +109,8 @@ class SeismicCubeset(Dataset):
     ----------
     geometries : dict
         Mapping from cube names to instances of :class:`~.SeismicGeometry`, which holds information
-        about that cube structure. :meth:`~.load_geometries` is used to infer that structure.
+        about that cube structure. Instances are created on the first access to the respective key,
+        and :meth:`~.load_geometries` is used to infer that structure.
         Note that no more that one trace is loaded into the memory at a time.
 
     labels : dict
@@ -47,16 +127,19 @@ class SeismicCubeset(Dataset):
         super().__init__(index, batch_class=batch_class, preloaded=preloaded, *args, **kwargs)
         self.crop_index, self.crop_points = None, None
 
-        self.geometries = IndexedDict({ix: SeismicGeometry(self.index.get_fullpath(ix), process=False)
-                                       for ix in self.indices})
+        self.geometries = LazyIndexedDict(self.indices, factory=self._make_geometry)
         self.labels = IndexedDict({ix: [] for ix in self.indices})
-        self.samplers = IndexedDict({ix: None for ix in self.indices})
+        self.samplers = {ix: None for ix in self.indices}
         self._sampler = None
         self._p, self._bins = None, None
 
         self.grid_gen, self.grid_info, self.grid_iters = None, None, None
         self.shapes_gen, self.orders_gen = None, None
 
+    def _make_geometry(self, ix):
+        """ Create unprocessed geometry for cube `ix`: used to fill `geometries` on the first access. """
+        return SeismicGeometry(self.index.get_fullpath(ix), process=False)
+
 
     @classmethod
     def from_horizon(cls, horizon):
@@ -103,23 +186,29 @@ class SeismicCubeset(Dataset):
                                  drop_last=drop_last, bar=bar, bar_desc=bar_desc, iter_params=iter_params)
 
 
-    def load_geometries(self, logs=True, **kwargs):
+    def load_geometries(self, logs=True, max_workers=None, **kwargs):
         """ Load geometries into dataset-attribute.
 
         Parameters
         ----------
         logs : bool
             Whether to create logs. If True, .log file is created next to .sgy-cube location.
+        max_workers : int, optional
+            Number of threads to process geometries with.
 
         Returns
         -------
         SeismicCubeset
             Same instance with loaded geometries.
         """
-        for ix in self.indices:
-            self.geometries[ix].process(**kwargs)
+        def _process(geometry):
+            geometry.process(**kwargs)
             if logs:
-                self.geometries[ix].log()
+                geometry.log()
+
+        # Processing is dominated by reading headers and meta from disk, so cubes are handled in parallel threads
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_process, [self.geometries[ix] for ix in self.indices]))
 
     def convert_to_hdf5(self, postfix=''):
         """ Converts every cube in dataset from `.segy` to `.hdf5`. """
@@ -127,7 +216,8 @@ class SeismicCubeset(Dataset):
             self.geometries[ix].make_hdf5(postfix=postfix)
 
 
-    def create_labels(self, paths=None, filter_zeros=True, dst='labels', labels_class=None, **kwargs):
+    def create_labels(self, paths=None, filter_zeros=True, dst='labels', labels_class=None, max_workers=None,
+                      **kwargs):
         """ Create labels (horizons, facies, etc) from given paths.
 
         Parameters
@@ -136,27 +226,34 @@ class SeismicCubeset(Dataset):
             Mapping from indices to txt paths with labels.
         dst : str
             Name of attribute to put labels in.
+        labels_class : type, optional
+            Class of labels. If None, then chosen for each cube separately:
+            :class:`.Horizon` for structured geometries and :class:`.UnstructuredHorizon` otherwise.
+        max_workers : int, optional
+            Number of threads to load labels of one cube with.
 
         Returns
         -------
         SeismicCubeset
             Same instance with loaded labels.
         """
+        # Every cube gets its labels in the order of indices, so storage is filled lazily.
+        # It is still an IndexedDict, as labels are often accessed by position
         if not hasattr(self, dst):
-            setattr(self, dst, IndexedDict({ix: dict() for ix in self.indices}))
+            setattr(self, dst, IndexedDict())
 
+        storage = getattr(self, dst)
         for ix in self.indices:
-            if labels_class is None:
-                if self.geometries[ix].structured:
-                    labels_class = Horizon
-                else:
-                    labels_class = UnstructuredHorizon
-
-            label_list = [labels_class(path, self.geometries[ix], **kwargs) for path in paths[ix]]
-            label_list.sort(key=lambda label: label.h_mean)
+            geometry = self.geometries[ix]
+            label_class = labels_class or (Horizon if geometry.structured else UnstructuredHorizon)
+
+            # Reading files is I/O bound, so labels are loaded in parallel threads
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                label_list = list(executor.map(partial(label_class, geometry=geometry, **kwargs), paths[ix]))
+            label_list.sort(key=attrgetter('h_mean'))
             if filter_zeros:
                 _ = [getattr(item, 'filter')() for item in label_list]
-            getattr(self, dst)[ix] = label_list
+            storage[ix] = label_list
 
     @property
     def sampler(self):
@@ -193,7 +290,6 @@ class SeismicCubeset(Dataset):
         -----
         Passed `dataset` must have `geometries` and `labels` attributes if you want to create HistoSampler.
         """
-        #pylint: disable=cell-var-from-loop
         lowcut, highcut = [0, 0, 0], [1, 1, 1]
         transforms = transforms or dict()
 
@@ -209,10 +305,10 @@ class SeismicCubeset(Dataset):
                 sampler = NumpySampler(**kwargs)
 
             elif mode[ix] == 'hist' or mode[ix] == 'horizon':
-                sampler = 0 & NumpySampler('n', dim=3)
-                for i, label in enumerate(self.labels[ix]):
+                labels = self.labels[ix]
+                for label in labels:
                     label.create_sampler(**kwargs)
-                    sampler = sampler | label.sampler
+                sampler = mixture([label.sampler for label in labels] or [0 & NumpySampler('n', dim=3)])
             else:
                 sampler = NumpySampler('u', low=0, high=1, dim=3)
 
@@ -223,11 +319,11 @@ class SeismicCubeset(Dataset):
         # One sampler to rule them all
         p = p or [1/len(self) for _ in self.indices]
 
-        sampler = 0 & NumpySampler('n', dim=4)
-        for i, ix in enumerate(self.indices):
-            sampler_ = (ConstantSampler(ix)
-                        & samplers[ix].apply(astype_object))
-            sampler = sampler | (p[i] & sampler_)
+        # Cubes are referenced by their codes, so that sampled points stay numeric until the very end
+        names = np.array(self.indices, dtype=object)
+        sampler = mixture([p[i] & (ConstantSampler(i) & samplers[ix])
+                           for i, ix in enumerate(self.indices)])
+        sampler = sampler.apply(partial(decode_points, names=names))
         setattr(self, dst, sampler)
 
     def modify_sampler(self, dst, mode='iline', low=None, high=None,
@@ -289,33 +385,27 @@ class SeismicCubeset(Dataset):
         # Keep only points from region
         if (low != 0) or (high != 1):
             sampler = sampler.truncate(low=low, high=high, prob=high-low,
-                                       expr=lambda p: p[:, axis+1])
+                                       expr=partial(points_axis, axis=axis))
+
+        # Shapes of all cubes, looked up once: sampled names are located in the sorted `cube_names`
+        if each is not None or to_cube:
+            cube_names = np.array(sorted(self.indices), dtype=object)
+            cube_shapes = np.array([self.geometries[name].cube_shape for name in cube_names], dtype=np.float64)
 
         # Keep only every `each`-th point
         if each is not None:
-            def filter_out(array):
-                for cube_name in np.unique(array[:, 0]):
-                    shape = self.geometries[cube_name].cube_shape[axis]
-                    ticks = np.arange(each_start, shape, each)
-                    name_idx = np.asarray(array[:, 0] == cube_name).nonzero()
-
-                    arr = np.rint(array[array[:, 0] == cube_name][:, axis+1].astype(float)*shape).astype(int)
-                    array[name_idx, np.full_like(name_idx, axis+1)] = round_to_array(arr, ticks).astype(float) / shape
-                return array
-
-            sampler = sampler.apply(filter_out)
+            sampler = sampler.apply(partial(round_points_to_ticks, axis=axis,
+                                            cube_names=cube_names, cube_shapes=cube_shapes,
+                                            each_start=each_start, each=each))
 
         # Change representation of points from unit cube to cube coordinates
         if to_cube:
-            def get_shapes(name):
-                return self.geometries[name].cube_shape
-
-            def coords_to_cube(array):
-                shapes = np.array(list(map(get_shapes, array[:, 0])))
-                array[:, 1:] = np.rint(array[:, 1:].astype(float) * shapes).astype(int)
-                return array
-
-            sampler = sampler.apply(coords_to_cube)
+            # Shapes lookup is chosen once: with one cube there is no need to match names of points
+            if len(cube_names) == 1:
+                transform = partial(scale_points, shapes=cube_shapes[0])
+            else:
+                transform = partial(points_to_cube, cube_names=cube_names, cube_shapes=cube_shapes)
+            sampler = sampler.apply(transform)
 
         # Apply additional transformations to points
         if callable(post):
@@ -340,11 +430,20 @@ class SeismicCubeset(Dataset):
                  .next_batch(self.size))
 
         unsalted = np.array([batch.unsalt(item) for item in batch.indices])
-        background = np.zeros_like(self.geometries[idx].zero_traces)
-
-        for slice_ in np.array(batch.locations)[unsalted == self.indices[idx]]:
-            idx_i, idx_x, _ = slice_
-            background[idx_i, idx_x] += 1
+        locations = np.array(batch.locations)[unsalted == self.indices[idx]]
+        i_len, x_len = self.geometries[idx].cube_shape[:2]
+
+        # Count crops over every trace: scatter corners of crops into difference array, then integrate it
+        i_start, i_stop, x_start, x_stop = [np.array([min(getattr(location[axis], attr), length)
+                                                      for location in locations], dtype=np.int32)
+                                            for axis, length in zip((0, 1), (i_len, x_len))
+                                            for attr in ('start', 'stop')]
+        difference = np.zeros((i_len + 1, x_len + 1), dtype=np.int32)
+        np.add.at(difference, (i_start, x_start), 1)
+        np.add.at(difference, (i_start, x_stop), -1)
+        np.add.at(difference, (i_stop, x_start), -1)
+        np.add.at(difference, (i_stop, x_stop), 1)
+        background = np.cumsum(np.cumsum(difference, axis=0), axis=1)[:-1, :-1]
 
         if normalize:
             background = (background > 0).astype(int)
@@ -386,7 +485,8 @@ class SeismicCubeset(Dataset):
 
 
     def make_grid(self, cube_name, crop_shape, ilines=None, xlines=None, heights=None,
-                  overlap=None, overlap_factor=None, batch_size=16, filtering_matrix=None, filter_threshold=0):
+                  overlap=None, overlap_factor=None, batch_size=16, filtering_matrix=None, filter_threshold=0,
+                  prefetch=0):
         """ Create regular grid of points in cube.
         This method is usually used with `assemble_predict` action of SeismicCropBatch.
 
@@ -422,6 +522,8 @@ class SeismicCubeset(Dataset):
             Exclusive lower bound for non-gap number of points (with 0's in the filtering_matrix)
             in a crop in the grid. Default value is 0.
             If float, proportion from the total number of traces in a crop will be computed.
+        prefetch : int
+            Number of batches of points to prepare in background threads. Check :class:`.BatchGenerator` for details.
         """
         geometry = self.geometries[cube_name]
         overlap = overlap or crop_shape
@@ -452,50 +554,50 @@ class SeismicCubeset(Dataset):
            heights[1] >= geometry.depth:
             raise ValueError('Ranges must contain in the cube.')
 
+        shifts = np.array([ilines[0], xlines[0], heights[0]], dtype=np.int32)
+
         # Make separate grids for every axis
         def _make_axis_grid(axis_range, stride, length, crop_shape):
             grid = np.arange(*axis_range, stride)
-            grid_ = [x for x in grid if x + crop_shape < length]
+            grid_ = grid[grid + crop_shape < length]
             if len(grid) != len(grid_):
-                grid_ += [axis_range[1] - crop_shape]
-            return sorted(grid_)
+                grid_ = np.append(grid_, axis_range[1] - crop_shape)
+            # Sorted and without duplicates: the last tick can coincide with one of the kept ones
+            return np.unique(grid_)
 
         ilines_grid = _make_axis_grid(ilines, overlap[0], geometry.ilines_len, crop_shape[0])
         xlines_grid = _make_axis_grid(xlines, overlap[1], geometry.xlines_len, crop_shape[1])
         heights_grid = _make_axis_grid(heights, overlap[2], geometry.depth, crop_shape[2])
 
-        # Every point in grid contains reference to cube
-        # in order to be valid input for `crop` action of SeismicCropBatch
-        grid = []
-        for il in ilines_grid:
-            for xl in xlines_grid:
-                if np.prod(crop_shape[:2]) - np.sum(filtering_matrix[il: il + crop_shape[0],
-                                                                     xl: xl + crop_shape[1]]) > filter_threshold:
-                    for h in heights_grid:
-                        point = [cube_name, il, xl, h]
-                        grid.append(point)
+        # Number of filtered traces in every spatial position of the grid, computed with summed-area table
+        il_start, xl_start = np.meshgrid(ilines_grid, xlines_grid, indexing='ij')
+        filtered = window_sum(make_summed_area_table(filtering_matrix),
+                              il_start, il_start + crop_shape[0], xl_start, xl_start + crop_shape[1])
+        mask = np.prod(crop_shape[:2]) - filtered > filter_threshold
 
-        shifts = np.array([ilines[0], xlines[0], heights[0]])
+        # Cartesian product of kept spatial positions and heights: iline-major order, heights change the fastest
+        spatial = np.stack([il_start[mask], xl_start[mask]], axis=1)
+        coords = np.empty((len(spatial) * len(heights_grid), 3), dtype=np.int32)
+        coords[:, :2] = np.repeat(spatial, len(heights_grid), axis=0)
+        coords[:, 2] = np.tile(heights_grid, len(spatial))
 
-        grid = np.array(grid, dtype=object)
+        # Check if grid is not empty
+        grid_array = coords - shifts if len(coords) > 0 else []
 
         # Creating and storing all the necessary things
-        # Check if grid is not empty
-        if len(grid) > 0:
-            grid_gen = (grid[i:i+batch_size]
-                        for i in range(0, len(grid), batch_size))
-            grid_array = grid[:, 1:].astype(int) - shifts
-        else:
-            grid_gen = iter(())
-            grid_array = []
+        # Reference to the cube is added to points only at batch creation
+        n_crops = len(coords)
 
         predict_shape = (ilines[1] - ilines[0],
                          xlines[1] - xlines[0],
                          heights[1] - heights[0])
 
-        self.grid_gen = lambda: next(grid_gen)
-        self.grid_iters = - (-len(grid) // batch_size)
+        self.grid_gen = BatchGenerator(coords, batch_size, transform=partial(make_points, cube_name),
+                                       prefetch=prefetch)
+        self.grid_iters = len(self.grid_gen)
         self.grid_info = {
+            'n_crops': n_crops,
+            'coords': coords,
             'grid_array': grid_array,
             'predict_shape': predict_shape,
             'crop_shape': crop_shape,
@@ -533,8 +635,9 @@ class SeismicCubeset(Dataset):
 
         horizons = Horizon.from_mask(mask, grid_info,
                                      threshold=threshold, averaging=averaging, minsize=minsize, prefix=prefix)
+        # Storage is filled lazily: only cubes that were actually predicted get a key
         if not hasattr(self, dst):
-            setattr(self, dst, IndexedDict({ix: dict() for ix in self.indices}))
+            setattr(self, dst, IndexedDict())
 
         getattr(self, dst)[cube_name] = horizons
 
@@ -649,7 +752,7 @@ class SeismicCubeset(Dataset):
 
 
     def make_extension_grid(self, cube_name, crop_shape, labels_src='predicted_labels',
-                            stride=10, batch_size=16, coverage=True, **kwargs):
+                            stride=10, batch_size=16, coverage=True, prefetch=0, tile_size=None, **kwargs):
         """ Create a non-regular grid of points in a cube for extension procedure.
         Each point defines an upper rightmost corner of a crop which contains a holey
         horizon.
@@ -672,63 +775,63 @@ class SeismicCubeset(Dataset):
         coverage : bool or array, optional
             A boolean array of size (ilines_len, xlines_len) indicating points that will
             not be used as new crop coordinates, e.g. already covered points.
-            If True then coverage array will be initialized with zeros and updated with
+            If True then coverage array will be initialized with zeros of `uint8` dtype and updated with
             covered points.
             If False then all points from the horizon border will be used.
+        prefetch : int
+            Number of batches of points to prepare in background threads. Check :class:`.BatchGenerator` for details.
+        tile_size : int, optional
+            If given, border points are processed in square tiles of this size instead of raster order.
+            As coverage is updated point by point, the order changes which crops are generated.
+            No speed-up was measured for it on a 3000x3000 horizon, so raster order is used by default.
+        kwargs : dict
+            Other parameters are passed to :func:`.gen_extension_crops`.
         """
         horizon = getattr(self, labels_src)[cube_name][0] if isinstance(labels_src, str) else labels_src
 
-        zero_traces = horizon.geometry.zero_traces
-        hor_matrix = horizon.full_matrix.astype(np.int32)
-        coverage_matrix = np.zeros_like(zero_traces) if isinstance(coverage, bool) else coverage
-
-        # get horizon boundary points in horizon.matrix coordinates
-        border_points = np.array(list(zip(*np.where(horizon.boundaries_matrix))))
-
-        # shift border_points to global coordinates
-        border_points[:, 0] += horizon.i_min
-        border_points[:, 1] += horizon.x_min
-
-        crops, orders, shapes = [], [], []
-
-        for i, point in enumerate(border_points):
-            if coverage_matrix[point[0], point[1]] == 1:
-                continue
-
-            result = gen_crop_coordinates(point,
-                                          hor_matrix, zero_traces,
-                                          stride, crop_shape,
-                                          horizon.FILL_VALUE, **kwargs)
-            if not result:
-                continue
-            new_point, shape, order = result
-            crops.extend(new_point)
-            shapes.extend(shape)
-            orders.extend(order)
-
-            if coverage is not False:
-                for _point, _shape in zip(new_point, shape):
-                    coverage_matrix[_point[0]: _point[0] + _shape[0],
-                                    _point[1]: _point[1] + _shape[1]] = 1
-
-        crops = np.array(crops, dtype=np.object).reshape(-1, 3)
-        cube_names = np.array([cube_name] * len(crops), dtype=np.object).reshape(-1, 1)
-        shapes = np.array(shapes)
-        crops = np.concatenate([cube_names, crops], axis=1)
-
-        crops_gen = (crops[i:i+batch_size]
-                     for i in range(0, len(crops), batch_size))
-        shapes_gen = (shapes[i:i+batch_size]
-                      for i in range(0, len(shapes), batch_size))
-        orders_gen = (orders[i:i+batch_size]
-                      for i in range(0, len(orders), batch_size))
-
-        self.grid_gen = lambda: next(crops_gen)
-        self.shapes_gen = lambda: next(shapes_gen)
-        self.orders_gen = lambda: next(orders_gen)
-        self.grid_iters = - (-len(crops) // batch_size)
-        self.grid_info = {'cube_name': cube_name,
-                          'geom': horizon.geometry}
+        geometry = horizon.geometry
+        zero_traces = geometry.zero_traces
+        fill_value = horizon.FILL_VALUE
+        hor_matrix = horizon.put_on_full(dtype=np.int32)
+        empty_matrix = hor_matrix == fill_value
+        coverage_matrix = np.zeros(zero_traces.shape, dtype=np.uint8) if isinstance(coverage, bool) else coverage
+        update_coverage = coverage is not False
+
+        # Tables to count missing traces and unknown horizon points in any window in constant time.
+        # Counts are bounded by the number of traces, so `int32` is enough
+        zero_traces_table = make_summed_area_table(zero_traces, dtype=np.int32)
+        empty_table = make_summed_area_table(empty_matrix, dtype=np.int32)
+
+        # get horizon boundary points in horizon.matrix coordinates and shift them to global coordinates
+        border_points = np.argwhere(horizon.boundaries_matrix)
+        border_points += np.array([horizon.i_min, horizon.x_min], dtype=border_points.dtype)
+
+        # Drop points, that are already covered by the passed array, in one gather
+        if not isinstance(coverage, bool):
+            border_points = border_points[coverage_matrix[border_points[:, 0], border_points[:, 1]] != 1]
+
+        # Visit points tile by tile, if requested
+        if tile_size is not None:
+            if tile_size <= 0:
+                raise ValueError(f'`tile_size` must be positive, got {tile_size}.')
+            n_tiles = (hor_matrix.shape[1] + tile_size - 1) // tile_size
+            tile_keys = (border_points[:, 0] // tile_size) * n_tiles + border_points[:, 1] // tile_size
+            border_points = border_points[np.argsort(tile_keys, kind='stable')]
+
+        crops, shapes, orders = gen_extension_crops(border_points, hor_matrix, zero_traces_table, empty_table,
+                                                    coverage_matrix, update_coverage,
+                                                    stride, np.asarray(crop_shape, dtype=np.int64), **kwargs)
+
+        self.grid_gen = BatchGenerator(crops, batch_size, transform=partial(make_points, cube_name),
+                                       prefetch=prefetch)
+        self.shapes_gen = BatchGenerator(shapes, batch_size)
+        self.orders_gen = BatchGenerator(orders, batch_size)
+        self.grid_iters = len(self.grid_gen)
+        self.grid_info = {'n_crops': len(crops),
+                          'coords': crops,
+                          'shapes': shapes,
+                          'cube_name': cube_name,
+                          'geom': geometry}
 
 
     def assemble_crops(self, crops, grid_info='grid_info', order=None, fill_value=0):
@@ -191,8 +191,16 @@ class SeismicGeometry:
                 if hasattr(self, attr) and getattr(self, attr) is not None:
                     file_meta['/info/' + attr] = getattr(self, attr)
 
-    def load_meta(self):
-        """ Retrieve stored stats from disk. """
+    def load_meta(self, memmap=True):
+        """ Retrieve stored stats from disk.
+
+        Parameters
+        ----------
+        memmap : bool
+            Whether to memory-map spatial matrices instead of reading them into memory.
+            Mapped arrays are paged from disk by the OS on demand. They are copy-on-write:
+            changes are kept in memory and never written back to the file.
+        """
         path_meta = os.path.splitext(self.path)[0] + '.meta'
 
         # Backward compatibility
@@ -203,12 +211,27 @@ class SeismicGeometry:
         with h5py.File(path_meta, "r") as file_meta:
             for item in self.PRESERVED:
                 try:
-                    value = file_meta['/info/' + item][()]
+                    dataset = file_meta['/info/' + item]
+                    value = self.memmap_dataset(dataset, path_meta) if memmap else None
+                    value = dataset[()] if value is None else value
                     setattr(self, item, value)
                     self.loaded.append(item)
                 except KeyError:
                     pass
 
+    @staticmethod
+    def memmap_dataset(dataset, path):
+        """ Map contiguous numeric HDF5 dataset with two or more dimensions to memory in copy-on-write mode.
+        Returns None, if dataset can't be mapped (chunked, compressed, etc).
+        """
+        if dataset.ndim < 2 or dataset.chunks is not None or dataset.dtype.kind not in 'biuf':
+            return None
+
+        offset = dataset.id.get_offset()
+        if offset is None:
+            return None
+        return np.memmap(path, mode='c', dtype=dataset.dtype, shape=dataset.shape, offset=offset)
+
 
     def scaler(self, array, mode='minmax'):
         """ Normalize array of amplitudes cut from the cube.
@@ -255,6 +278,14 @@ class SeismicGeometry:
         locations[axis] = slice(loc, loc + 1)
         return locations
 
+    def lines_affine(self, n_columns=3):
+        """ Shift and scale of the transform from line coordinates (ilines, xlines, depths) to cubic ones,
+        so that `cubic = (lines - shift) / scale`. Columns after the first two are treated as depths.
+        """
+        shift = np.array([self.ilines_offset, self.xlines_offset] + [self.delay] * (n_columns - 2), dtype=np.float64)
+        scale = np.array([1, 1] + [self.sample_rate] * (n_columns - 2), dtype=np.float64)
+        return shift, scale
+
 
     # Spatial matrices
     @lru_cache(100)
@@ -2,7 +2,7 @@
 #pylint: disable=too-many-lines, import-error
 import os
 from copy import copy
-from itertools import product
+from itertools import product, chain
 from textwrap import dedent
 
 import numpy as np
@@ -14,9 +14,7 @@ from scipy.ndimage.morphology import binary_fill_holes, binary_erosion
 from scipy.ndimage import find_objects
 from skimage.measure import label
 
-from ..batchflow import HistoSampler
-
-from .utils import round_to_array, groupby_mean, groupby_min, groupby_max
+from .utils import round_to_array, groupby_mean, groupby_min, groupby_max, histogramdd, SparseHistoSampler
 from .plotters import plot_image
 
 
@@ -200,7 +198,17 @@ class UnstructuredHorizon:
 
             others = self.geometry.dataframe[self.geometry.dataframe.index.get_level_values(axis) == loc]
             others = others.index.get_level_values(other_axis).values
-            others_iterator = np.array([np.where(others == item[other_axis])[0][0] for item in iterator])
+            # Position of the first occurrence of each item in `others`, found with one binary search
+            sorter = np.argsort(others, kind='stable')
+            values = np.array([item[other_axis] for item in iterator])
+            positions = np.searchsorted(others, values, sorter=sorter)
+
+            # Binary search returns insertion positions, so items missing from `others` must be checked explicitly
+            found = positions < len(others)
+            found[found] = others[sorter[positions[found]]] == values[found]
+            if not found.all():
+                raise ValueError(f'Traces {values[~found].tolist()} are not present at location {loc}.')
+            others_iterator = sorter[positions]
 
             idx_1 = np.zeros_like(others_iterator) if axis == 0 else others_iterator
             idx_2 = np.zeros_like(others_iterator) if axis == 1 else others_iterator
@@ -527,19 +535,16 @@ class Horizon:
     # Coordinate transforms
     def lines_to_cubic(self, array):
         """ Convert ilines-xlines to cubic coordinates system. """
-        array[:, 0] -= self.geometry.ilines_offset
-        array[:, 1] -= self.geometry.xlines_offset
-        array[:, 2] -= self.geometry.delay
-        array[:, 2] /= self.geometry.sample_rate
+        shift, scale = self.geometry.lines_affine(array.shape[1])
+        array -= shift
+        array /= scale
         return array
 
     def cubic_to_lines(self, array):
         """ Convert cubic coordinates to ilines-xlines system. """
-        array = array.astype(float)
-        array[:, 0] += self.geometry.ilines_offset
-        array[:, 1] += self.geometry.xlines_offset
-        array[:, 2] *= self.geometry.sample_rate
-        array[:, 2] += self.geometry.delay
+        shift, scale = self.geometry.lines_affine(array.shape[1])
+        array = array * scale
+        array += shift
         return array
 
 
@@ -562,13 +567,8 @@ class Horizon:
         if transform:
             points = self.lines_to_cubic(points)
         if verify:
-            idx = np.where((points[:, 0] >= 0) &
-                           (points[:, 1] >= 0) &
-                           (points[:, 2] >= 0) &
-                           (points[:, 0] < self.cube_shape[0]) &
-                           (points[:, 1] < self.cube_shape[1]) &
-                           (points[:, 2] < self.cube_shape[2]))[0]
-            points = points[idx]
+            mask = ((points >= 0) & (points < self.cube_shape)).all(axis=1)
+            points = points[mask]
         self.points = np.rint(points).astype(np.int32)
 
         # Collect stats on separate axes. Note that depth stats are properties
@@ -583,18 +583,33 @@ class Horizon:
                              dtype=np.int32)
 
 
-    def from_file(self, path, transform=True, **kwargs):
-        """ Init from path to either CHARISMA or REDUCED_CHARISMA csv-like file. """
+    def from_file(self, path, transform=True, cache=False, **kwargs):
+        """ Init from path to either CHARISMA or REDUCED_CHARISMA csv-like file.
+        If `cache`, parsed points are stored next to the file. Check :meth:`.file_to_points` for details.
+        """
         _ = kwargs
 
         self.path = path
         self.name = os.path.basename(path)
-        points = self.file_to_points(path)
+        points = self.file_to_points(path, cache=cache)
         self.from_points(points, transform)
 
-    def file_to_points(self, path):
-        """ Get point cloud array from file values. """
-        #pylint: disable=anomalous-backslash-in-string
+    def file_to_points(self, path, cache=False):
+        """ Get point cloud array from file values.
+
+        Parameters
+        ----------
+        path : str
+            Path to CHARISMA or REDUCED_CHARISMA csv-like file.
+        cache : bool
+            Whether to save parsed points in `.npy` format next to the file.
+            Next time, if it is newer than the file, it is memory-mapped (copy-on-write) instead of parsing
+            the text again.
+        """
+        path_cache = path + '.npy'
+        if cache and os.path.exists(path_cache) and os.path.getmtime(path_cache) >= os.path.getmtime(path):
+            return np.load(path_cache, mmap_mode='c')
+
         with open(path) as file:
             line_len = len(file.readline().split(' '))
         if line_len == 3:
@@ -604,9 +619,14 @@ class Horizon:
         else:
             raise ValueError('Horizon labels must be in CHARISMA or REDUCED_CHARISMA format.')
 
-        df = pd.read_csv(path, sep='\s+', names=names, usecols=Horizon.COLUMNS)
+        # Single-character separator with skipped repeated spaces is parsed faster than the `\s+` regex
+        df = pd.read_csv(path, sep=' ', skipinitialspace=True, names=names, usecols=Horizon.COLUMNS)
         df.sort_values(Horizon.COLUMNS, inplace=True)
-        return df.values
+        points = df.values
+
+        if cache:
+            np.save(path_cache, points)
+        return points
 
 
     def from_matrix(self, matrix, i_min, x_min, length=None, **kwargs):
@@ -642,8 +662,11 @@ class Horizon:
     @staticmethod
     def dict_to_points(dictionary):
         """ Convert mapping to points array. """
-        points = np.hstack([np.array(list(dictionary.keys())),
-                            np.array(list(dictionary.values())).reshape(-1, 1)])
+        # Read keys and values as flat streams of numbers, without creating intermediate lists of tuples
+        n = len(dictionary)
+        points = np.empty((n, 3), dtype=np.float64)
+        points[:, :2] = np.fromiter(chain.from_iterable(dictionary.keys()), dtype=np.float64, count=2*n).reshape(n, 2)
+        points[:, 2] = np.fromiter(dictionary.values(), dtype=np.float64, count=n)
         return points
 
 
@@ -857,7 +880,7 @@ class Horizon:
         else:
             points = self.points
 
-        self.sampler = HistoSampler(np.histogramdd(points/self.cube_shape, bins=bins))
+        self.sampler = SparseHistoSampler(histogramdd(points/self.cube_shape, bins=bins, dtype=np.uint32))
 
 
     def add_to_mask(self, mask, locations=None, width=3, alpha=1, **kwargs):
@@ -1502,12 +1525,12 @@ class Horizon:
         return dedent(msg)
 
 
-    def put_on_full(self, matrix=None, fill_value=None):
+    def put_on_full(self, matrix=None, fill_value=None, dtype=np.float32):
         """ Create a matrix in cubic coordinate system. """
         matrix = matrix if matrix is not None else self.matrix
         fill_value = fill_value if fill_value is not None else self.FILL_VALUE
 
-        background = np.full(self.cube_shape[:-1], fill_value, dtype=np.float32)
+        background = np.full(self.cube_shape[:-1], fill_value, dtype=dtype)
         background[self.i_min:self.i_max+1, self.x_min:self.x_max+1] = matrix
         return background
 
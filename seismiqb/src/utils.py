@@ -1,7 +1,8 @@
 """ Utility functions. """
 from math import isnan
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from threading import RLock
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from hashlib import blake2b
 
@@ -12,6 +13,8 @@ import segyio
 
 from numba import njit, prange
 
+from ..batchflow import Sampler, HistoSampler, make_rng
+
 
 
 def file_print(msg, path):
@@ -62,6 +65,115 @@ class IndexedDict(OrderedDict):
         return super().__getitem__(key)
 
 
+class LazyIndexedDict(IndexedDict):
+    """ IndexedDict with a predefined sequence of keys, values for which are made by `factory` on the first access.
+    Integer subscription, membership tests and `get` take into account all of the `keys`, regardless of which
+    values are already made; iteration goes over the made ones only.
+    """
+    def __init__(self, keys=(), factory=None):
+        super().__init__()
+        self.keys_order = list(keys)
+        self.factory = factory
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            key = self.keys_order[key]
+        return dict.__getitem__(self, key)
+
+    def __missing__(self, key):
+        if self.factory is None or key not in self.keys_order:
+            raise KeyError(key)
+        value = self.factory(key)
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (self.factory is not None and key in self.keys_order)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+
+class BatchGenerator:
+    """ Callable, that returns consecutive batches of an array: one batch per call.
+    Unlike a generator, keeps the position explicitly, so it can be restarted and safely called from multiple threads.
+    `StopIteration` is raised when the array is exhausted.
+
+    Parameters
+    ----------
+    array : sequence
+        Items to split into batches.
+    batch_size : int
+        Number of items in each batch.
+    transform : callable, optional
+        Function to apply to each batch before returning it.
+    prefetch : int
+        Number of batches to prepare in background threads ahead of their request.
+        If 0, batches are made at the time of call.
+    """
+    def __init__(self, array, batch_size, transform=None, prefetch=0):
+        self.array = array
+        self.batch_size = batch_size
+        self.transform = transform
+        self.prefetch = prefetch
+
+        self.lock = RLock()
+        self.executor = ThreadPoolExecutor(max_workers=prefetch) if prefetch else None
+        self.reset()
+
+    def __len__(self):
+        """ Total number of batches. """
+        return (len(self.array) + self.batch_size - 1) // self.batch_size
+
+    def reset(self):
+        """ Start from the first batch. """
+        with self.lock:
+            self.position = 0
+            self.futures = deque()
+
+    def make_batch(self, start):
+        """ Slice the array and apply `transform`. """
+        batch = self.array[start:start + self.batch_size]
+        return self.transform(batch) if self.transform is not None else batch
+
+    def _advance(self):
+        """ Move position to the next batch. Returns start of the current batch or None, if exhausted. """
+        if self.position >= len(self.array):
+            return None
+        start = self.position
+        self.position += self.batch_size
+        return start
+
+    def __call__(self):
+        with self.lock:
+            if self.executor is None:
+                start = self._advance()
+                if start is None:
+                    raise StopIteration
+            else:
+                while len(self.futures) <= self.prefetch:
+                    start = self._advance()
+                    if start is None:
+                        break
+                    self.futures.append(self.executor.submit(self.make_batch, start))
+                if not self.futures:
+                    raise StopIteration
+                future = self.futures.popleft()
+
+        if self.executor is None:
+            return self.make_batch(start)
+        return future.result()
+
+    def __iter__(self):
+        return self
+
+    __next__ = __call__
+
+
 
 def stable_hash(key):
     """ Hash that stays the same between different runs of Python interpreter. """
@@ -289,26 +401,181 @@ def convert_point_cloud(path, path_save, names=None, order=None, transform=None)
     data.to_csv(path_save, sep=' ', index=False, header=False)
 
 
-def gen_crop_coordinates(point, horizon_matrix, zero_traces,
-                         stride, shape, fill_value, zeros_threshold=0,
-                         empty_threshold=5, safe_stripe=0, num_points=2):
-    """ Generate crop coordinates next to the point with maximum horizon covered area.
+def make_summed_area_table(matrix, dtype=None):
+    """ Cumulative sums of 2D matrix along both axes, padded with zeros in front.
+    Allows to compute sum of elements over any rectangular window in constant time with :func:`window_sum`.
+    If `dtype` is given, sums are accumulated in it: for example, `np.int32` is enough for binary matrices.
+    """
+    return np.pad(np.cumsum(np.cumsum(matrix, axis=0, dtype=dtype), axis=1, dtype=dtype), ((1, 0), (1, 0)))
+
+
+def window_sum(table, i_start, i_stop, x_start, x_stop):
+    """ Sum of matrix elements in `[i_start:i_stop, x_start:x_stop]` window, computed from its summed-area table.
+    Stops are clipped to the matrix shape, same as in slicing. Works with both numbers and arrays of positions.
+    """
+    i_stop = np.minimum(i_stop, table.shape[0] - 1)
+    x_stop = np.minimum(x_stop, table.shape[1] - 1)
+    return (table[i_stop, x_stop] - table[i_start, x_stop]
+            - table[i_stop, x_start] + table[i_start, x_start])
+
+
+def histogramdd(sample, bins=10, dtype=np.float64):
+    """ Faster version of `np.histogramdd` for bins, defined by their number along each axis.
+    Instead of binary search in bin edges for every value, its bin is computed from bins width in one pass.
+    Bins span from minimum to maximum of `sample` along each axis, same as in `np.histogramdd`.
+    Explicit bin edges are passed to `np.histogramdd` itself.
 
     Parameters
     ----------
-    point : array-like
-        Coordinates of the point.
+    sample : ndarray
+        Array of (N, D) shape with points to make histogram of.
+    bins : int or sequence of ints or sequence of arrays
+        Number of bins along all axis, for each axis, or bin edges for each axis.
+    dtype : dtype
+        Type of bin counts. Default is the same as in `np.histogramdd`; integer types take less memory.
+
+    Returns
+    -------
+    tuple with histogram of (bins_0, ..., bins_D) shape and list of bin edges for each axis.
+    """
+    sample = np.asarray(sample)
+    n_dims = sample.shape[1]
+    bins = [bins] * n_dims if isinstance(bins, (int, np.integer)) else list(bins)
+    if not all(isinstance(item, (int, np.integer)) and item > 0 for item in bins):
+        hist, edges = np.histogramdd(sample, bins=bins)
+        return hist.astype(dtype, copy=False), edges
+
+    flat_indices = np.zeros(len(sample), dtype=np.int64)
+    edges = []
+    for axis, n_bins in enumerate(bins):
+        values = sample[:, axis]
+        low, high = (values.min(), values.max()) if len(values) else (0., 1.)
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        axis_edges = np.linspace(low, high, n_bins + 1)
+        edges.append(axis_edges)
+
+        # Maximum value goes to the last bin, same as in `np.histogramdd`
+        scaled = np.subtract(values, low, dtype=np.result_type(values, 1.0))
+        scaled *= n_bins / (high - low)
+        indices = scaled.astype(np.int64)
+        np.clip(indices, 0, n_bins - 1, out=indices)
+
+        # Fix values, moved to the neighbouring bin by rounding errors
+        indices -= values < axis_edges[indices]
+        indices += (values >= axis_edges[indices + 1]) & (indices < n_bins - 1)
+        flat_indices *= n_bins
+        flat_indices += indices
+
+    hist = np.bincount(flat_indices, minlength=np.prod(bins)).reshape(bins).astype(dtype, copy=False)
+    return hist, edges
+
+
+class SparseHistoSampler(HistoSampler):
+    """ Sampler based on a histogram, that stores only its non-empty bins.
+    Given the same seed, generates the same points as :class:`~.batchflow.HistoSampler`, but takes memory,
+    proportional to the number of non-empty bins instead of the total number of bins. That matters for surfaces
+    like horizons, which occupy a tiny fraction of bins of a 3D histogram.
+
+    Parameters
+    ----------
+    histo : tuple
+        Unnormalized histogram and bin edges, output of `np.histogramdd` or :func:`.histogramdd`.
+    seed : int
+        Seed for random numbers generator (see :func:`~.batchflow.make_rng`).
+
+    Attributes
+    ----------
+    bins : np.ndarray
+        Histogram, restored from non-empty bins on each access.
+    edges : list
+        Edges of the histogram.
+    nonzero_probs_idx : np.ndarray
+        Flat indices of non-empty bins.
+    nonzero_counts, nonzero_probs : np.ndarray
+        Counts and probabilities of non-empty bins.
+    nonzero_low, nonzero_high : np.ndarray
+        Lower and upper corners of non-empty bins.
+    """
+    #pylint: disable=super-init-not-called, non-parent-init-called
+    def __init__(self, histo, seed=None, **kwargs):
+        Sampler.__init__(self, histo, None, seed, **kwargs)
+        counts, self.edges = histo
+        counts = np.asarray(counts)
+        self.bins_shape = counts.shape
+
+        nonzero = np.flatnonzero(counts)
+        self._set_bins(nonzero, counts.reshape(-1)[nonzero])
+
+        self.state = make_rng(seed)
+        self.state_sampler = self.state.uniform
+
+    def _set_bins(self, indices, counts):
+        """ Store non-empty bins: their flat indices, counts, probabilities and corners. """
+        self.nonzero_probs_idx = indices
+        self.nonzero_counts = counts
+        self.nonzero_probs = counts / np.sum(counts)
+
+        positions = np.unravel_index(indices, self.bins_shape)
+        self.nonzero_low = np.stack([edges[:-1][pos] for edges, pos in zip(self.edges, positions)], axis=1)
+        self.nonzero_high = np.stack([edges[1:][pos] for edges, pos in zip(self.edges, positions)], axis=1)
+
+    @property
+    def bins(self):
+        """ Histogram with all of the bins. """
+        bins = np.zeros(self.bins_shape, dtype=self.nonzero_counts.dtype)
+        bins.flat[self.nonzero_probs_idx] = self.nonzero_counts
+        return bins
+
+    @property
+    def probs(self):
+        """ Flattened probabilities of all of the bins. """
+        return (self.bins / np.sum(self.nonzero_counts)).reshape(-1)
+
+    def sample(self, size):
+        """ Generate points from uniform distributions inside non-empty bins, chosen according to their counts. """
+        # Random draws are the same as in `HistoSampler`, which chooses from the same probabilities
+        positions = self.state.choice(len(self.nonzero_probs), p=self.nonzero_probs, size=size)
+        return self.state_sampler(low=self.nonzero_low[positions], high=self.nonzero_high[positions])
+
+    def update(self, points):
+        """ Update bins of sampler's histogram by throwing in additional points. Bin edges are not changed. """
+        counts = np.histogramdd(points, bins=self.edges)[0].reshape(-1)
+        nonzero = np.flatnonzero(counts)
+
+        indices = np.concatenate([self.nonzero_probs_idx, nonzero])
+        indices, inverse = np.unique(indices, return_inverse=True)
+        weights = np.concatenate([self.nonzero_counts, counts[nonzero]])
+        counts = np.bincount(inverse.reshape(-1), weights=weights).astype(self.nonzero_counts.dtype)
+        self._set_bins(indices, counts)
+
+
+def gen_extension_crops(border_points, horizon_matrix, zero_traces_table, empty_table,
+                        coverage_matrix, update_coverage, stride, shape, zeros_threshold=0,
+                        empty_threshold=5, safe_stripe=0, num_points=2):
+    """ Generate crops next to every border point of a horizon with maximum horizon covered area.
+    Points are processed in turn; points, already covered by previously generated crops, are skipped.
+    Work is done by a compiled kernel, specialized for the crop shape.
+
+    Parameters
+    ----------
+    border_points : ndarray
+        Integer array of (N, 2) shape with coordinates of horizon border points.
     horizon_matrix : ndarray
         `Full_matrix` attribute of the horizon.
-    zero_traces : ndarray
-        A boolean ndarray indicating zero traces in the cube.
+    zero_traces_table, empty_table : ndarray
+        Summed-area tables of zero traces and of unknown horizon points, made by :func:`make_summed_area_table`.
+    coverage_matrix : ndarray
+        Array of (ilines_len, xlines_len) shape with ones at covered points. Updated inplace, if `update_coverage`.
+    update_coverage : bool
+        Whether to mark areas of generated crops as covered.
     stride : int
         Distance between the point and a corner of a crop.
-    shape : array-like
+    shape : sequence
         The desired shape of the crops.
         Note that final shapes are made in both xline and iline directions. So if
         crop_shape is (1, 64, 64), crops of both (1, 64, 64) and (64, 1, 64) shape
-        will be defined.    fill_value : int
+        will be defined.
     zeros_threshold : int
         A maximum number of bad traces in a crop.
     empty_threshold : int
@@ -316,60 +583,121 @@ def gen_crop_coordinates(point, horizon_matrix, zero_traces,
     safe_stripe : int
         Distance between a crop and the ends of the cube.
     num_points : int
-        Returned number of crops. The maximum is four.
+        Number of crops to make for each point. The maximum is four.
+
+    Returns
+    -------
+    tuple of three int32 ndarrays of (M, 3) shape: crop coordinates, crop shapes and axes orders.
     """
-    candidates, shapes = [], []
-    orders, intersections = [], []
-    hor_height = horizon_matrix[point[0], point[1]]
-    ilines_len, xlines_len = horizon_matrix.shape
-
-    tested_iline_positions = [max(0, point[0] - stride),
-                              min(point[0] - shape[1] + stride, ilines_len - shape[1])]
-
-    for il in tested_iline_positions:
-        if (il > safe_stripe) and (il + shape[1] < ilines_len - safe_stripe):
-            num_missing_traces = np.sum(zero_traces[il: il + shape[1],
-                                                    point[1]: point[1] + shape[0]])
-            if num_missing_traces <= zeros_threshold:
-                horizon_patch = horizon_matrix[il: il + shape[1],
-                                               point[1]:point[1] + shape[0]]
-                num_empty = np.sum(horizon_patch == fill_value)
-                if num_empty > empty_threshold:
-                    candidates.append([il, point[1],
-                                       hor_height - shape[2] // 2])
-                    shapes.append([shape[1], shape[0], shape[2]])
-                    orders.append([0, 2, 1])
-                    intersections.append(shape[1] - num_empty)
-
-    tested_xline_positions = [max(0, point[1] - stride),
-                              min(point[1] - shape[1] + stride, xlines_len - shape[1])]
-
-    for xl in tested_xline_positions:
-        if (xl > safe_stripe) and (xl + shape[1] < xlines_len - safe_stripe):
-            num_missing_traces = np.sum(zero_traces[point[0]: point[0] + shape[0],
-                                                    xl: xl + shape[1]])
-            if num_missing_traces <= zeros_threshold:
-                horizon_patch = horizon_matrix[point[0]:point[0] + shape[0],
-                                               xl: xl + shape[1]]
-                num_empty = np.sum(horizon_patch == fill_value)
-                if num_empty > empty_threshold:
-                    candidates.append([point[0], xl,
-                                       hor_height - shape[2] // 2])
-                    shapes.append(shape)
-                    orders.append([2, 0, 1])
-                    intersections.append(shape[1] - num_empty)
-
-    if len(candidates) == 0:
-        return None
-
-    candidates_array = np.array(candidates)
-    shapes_array = np.array(shapes)
-    orders_array = np.array(orders)
-
-    top = np.argsort(np.array(intersections))[:num_points]
-    return (candidates_array[top], \
-                shapes_array[top], \
-                orders_array[top])
+    _, kernel = _make_extension_kernels(tuple(int(item) for item in shape))
+    return kernel(border_points, horizon_matrix, zero_traces_table, empty_table, coverage_matrix, update_coverage,
+                  stride, zeros_threshold, empty_threshold, safe_stripe, num_points)
+
+
+@njit
+def _table_window_sum(table, i_start, i_stop, x_start, x_stop):
+    """ Scalar version of :func:`window_sum` for use in compiled code. """
+    i_stop = min(i_stop, table.shape[0] - 1)
+    x_stop = min(x_stop, table.shape[1] - 1)
+    return (table[i_stop, x_stop] - table[i_start, x_stop]
+            - table[i_stop, x_start] + table[i_start, x_start])
+
+
+@lru_cache(maxsize=16)
+def _make_extension_kernels(shape):
+    """ Compile kernels for crops generation with `shape` values frozen as compile-time constants.
+    Compiled functions are cached, so the compilation happens once per crop shape.
+    """
+    shape_0, shape_1, shape_2 = shape
+
+    @njit
+    def gen_point_crops(point_i, point_x, horizon_matrix, zero_traces_table, empty_table,
+                        stride, zeros_threshold, empty_threshold, safe_stripe,
+                        candidates, candidates_shapes, candidates_orders, intersections):
+        """ Write up to four candidate crops next to the point into preallocated buffers.
+        Returns the number of written candidates.
+        """
+        ilines_len, xlines_len = horizon_matrix.shape
+        hor_height = horizon_matrix[point_i, point_x]
+        n = 0
+
+        for il in (max(0, point_i - stride), min(point_i - shape_1 + stride, ilines_len - shape_1)):
+            if (il > safe_stripe) and (il + shape_1 < ilines_len - safe_stripe):
+                num_missing_traces = _table_window_sum(zero_traces_table, il, il + shape_1,
+                                                       point_x, point_x + shape_0)
+                if num_missing_traces <= zeros_threshold:
+                    num_empty = _table_window_sum(empty_table, il, il + shape_1,
+                                                  point_x, point_x + shape_0)
+                    if num_empty > empty_threshold:
+                        candidates[n, 0], candidates[n, 1] = il, point_x
+                        candidates[n, 2] = hor_height - shape_2 // 2
+                        candidates_shapes[n, 0], candidates_shapes[n, 1] = shape_1, shape_0
+                        candidates_shapes[n, 2] = shape_2
+                        candidates_orders[n, 0], candidates_orders[n, 1], candidates_orders[n, 2] = 0, 2, 1
+                        intersections[n] = shape_1 - num_empty
+                        n += 1
+
+        for xl in (max(0, point_x - stride), min(point_x - shape_1 + stride, xlines_len - shape_1)):
+            if (xl > safe_stripe) and (xl + shape_1 < xlines_len - safe_stripe):
+                num_missing_traces = _table_window_sum(zero_traces_table, point_i, point_i + shape_0,
+                                                       xl, xl + shape_1)
+                if num_missing_traces <= zeros_threshold:
+                    num_empty = _table_window_sum(empty_table, point_i, point_i + shape_0,
+                                                  xl, xl + shape_1)
+                    if num_empty > empty_threshold:
+                        candidates[n, 0], candidates[n, 1] = point_i, xl
+                        candidates[n, 2] = hor_height - shape_2 // 2
+                        candidates_shapes[n, 0], candidates_shapes[n, 1] = shape_0, shape_1
+                        candidates_shapes[n, 2] = shape_2
+                        candidates_orders[n, 0], candidates_orders[n, 1], candidates_orders[n, 2] = 2, 0, 1
+                        intersections[n] = shape_1 - num_empty
+                        n += 1
+        return n
+
+    @njit
+    def gen_crops(border_points, horizon_matrix, zero_traces_table, empty_table, coverage_matrix, update_coverage,
+                  stride, zeros_threshold, empty_threshold, safe_stripe, num_points):
+        """ Loop over border points: check coverage, select the best candidates, update coverage. """
+        ilines_len, xlines_len = horizon_matrix.shape
+        n_variants = min(num_points, 4)
+
+        # Output buffers are sized by the upper bound and sliced to the number of written crops
+        crops = np.empty((len(border_points) * n_variants, 3), dtype=np.int32)
+        shapes = np.empty_like(crops)
+        orders = np.empty_like(crops)
+
+        candidates = np.empty((4, 3), dtype=np.int32)
+        candidates_shapes = np.empty((4, 3), dtype=np.int32)
+        candidates_orders = np.empty((4, 3), dtype=np.int32)
+        intersections = np.empty(4, dtype=np.int64)
+        position = 0
+
+        for k in range(len(border_points)):
+            point_i, point_x = border_points[k, 0], border_points[k, 1]
+            if coverage_matrix[point_i, point_x] == 1:
+                continue
+
+            n = gen_point_crops(point_i, point_x, horizon_matrix, zero_traces_table, empty_table,
+                                stride, zeros_threshold, empty_threshold, safe_stripe,
+                                candidates, candidates_shapes, candidates_orders, intersections)
+            if n == 0:
+                continue
+
+            top = np.argsort(intersections[:n], kind='mergesort')[:n_variants]
+            for idx in top:
+                crops[position] = candidates[idx]
+                shapes[position] = candidates_shapes[idx]
+                orders[position] = candidates_orders[idx]
+                position += 1
+
+                if update_coverage:
+                    i_stop = min(candidates[idx, 0] + candidates_shapes[idx, 0], ilines_len)
+                    x_stop = min(candidates[idx, 1] + candidates_shapes[idx, 1], xlines_len)
+                    coverage_matrix[candidates[idx, 0]:i_stop, candidates[idx, 1]:x_stop] = 1
+
+        return crops[:position], shapes[:position], orders[:position]
+
+    return gen_point_crops, gen_crops
 
 
 @njit
@@ -503,6 +831,32 @@ def round_to_array(values, ticks):
     return values
 
 
+@njit
+def round_to_ticks(values, length, start, step):
+    """ Jit-accelerated function to round unit cube coordinates along axis of `length` size
+    to the nearest value of regular grid with `start` and `step` parameters.
+
+    Parameters
+    ----------
+    values : array-like
+        Array of floats in [0, 1] range.
+    length : int
+        Length of the axis.
+    start : int
+        First tick of the grid.
+    step : int
+        Distance between consecutive ticks of the grid.
+
+    Returns
+    -------
+    array-like
+        Array of floats in [0, 1] range, each corresponding to a grid tick.
+    """
+    ticks = np.arange(start, length, step).astype(np.float64)
+    positions = round_to_array(np.rint(values * length), ticks)
+    return positions / length
+
+
 @njit
 def find_min_max(array):
     """ Get both min and max values in just one pass through array."""